@@ -11,9 +11,27 @@
 
 import pandas as pd
 import numpy as np
+import os
 import warnings
+import packaging.version
 from .exceptions import CptacDevError, ReindexMapError, FailedReindexWarning
 
+# Parser engine for pd.read_csv on our large data files. pyarrow's parser is multithreaded and much faster, so we use it when it's installed and pandas is new enough to support it; otherwise we fall back on pandas' default C parser.
+# pyarrow also lets us cache expensive intermediate tables as Parquet files, so PARQUET_AVAILABLE records whether we can.
+# pandas refuses to use a pyarrow older than its own minimum version, so an old pyarrow counts as not installed.
+try:
+    from pandas.compat._optional import VERSIONS as _PANDAS_OPTIONAL_VERSIONS
+except ImportError: # It's a private module, so don't depend on it being there
+    _PANDAS_OPTIONAL_VERSIONS = {}
+
+try:
+    import pyarrow
+    PARQUET_AVAILABLE = packaging.version.parse(pyarrow.__version__) >= packaging.version.parse(_PANDAS_OPTIONAL_VERSIONS.get("pyarrow", "0"))
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+CSV_ENGINE = "pyarrow" if PARQUET_AVAILABLE and packaging.version.parse(pd.__version__) >= packaging.version.parse("1.4.0") else "c"
+
 
 def average_replicates(df, common = '\.', to_drop = '\.\d$'):
     """Returns a df with one row for each patient_ID (all replicates for a patient are averaged)
@@ -39,6 +57,56 @@ def average_replicates(df, common = '\.', to_drop = '\.\d$'):
     df = df[~ df.index.str.contains(common)] # drop unaveraged replicate cols (averaged rows are kept)
     return df
 
+def replace_suffixes(index, pattern, replacements):
+    """Rewrite the labels of an index in a single pass, replacing each match of a regex according to its first group. This avoids calling str.replace once per suffix.
+
+    Parameters:
+    index (pandas.Index): The index whose labels to rewrite.
+    pattern (re.Pattern): Compiled regex to replace matches of. Its first group selects the replacement.
+    replacements (dict of str: str): For each possible value of the pattern's first group, the string to replace the whole match with.
+
+    Returns:
+    pandas.Index: The index with the suffixes replaced. The index name is kept.
+    """
+    return index.str.replace(pattern, lambda match: replacements[match.group(1)], regex=True)
+
+# Errors from reading or writing a Parquet cache that mean we should just go on without it. ImportError comes from pandas when it can't use the installed pyarrow.
+_PARQUET_CACHE_ERRORS = (OSError, ValueError, TypeError, NotImplementedError, ImportError)
+
+def read_with_parquet_cache(file_path, parse, cache_suffix):
+    """Parse a data file, caching the result in a Parquet file next to it. Later calls read the cache instead of parsing the file again, as long as the cache isn't older than the file. If pyarrow isn't installed, or the cache can't be read or written, we just parse the file.
+
+    The cache is only checked against the data file, not the code, so callers put a version number for their parse function in cache_suffix, and bump it whenever that function's output changes. Each parse function should have its own version, so changing one doesn't throw away the caches of the others.
+
+    Parameters:
+    file_path (str): The path to the data file.
+    parse (function): Takes the file path, and returns the parsed dataframe.
+    cache_suffix (str): Appended to file_path to name the cache file, e.g. ".v1.parquet". Include the parse function's version number.
+
+    Returns:
+    pandas.DataFrame: The parsed dataframe.
+    """
+    cache_path = file_path + cache_suffix
+    if PARQUET_AVAILABLE and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file_path):
+        try:
+            return pd.read_parquet(cache_path)
+        except _PARQUET_CACHE_ERRORS: # The cache is unreadable, so we'll parse the file instead, and replace the cache if we can
+            pass
+
+    df = parse(file_path)
+
+    if PARQUET_AVAILABLE:
+        temp_path = cache_path + ".tmp"
+        try:
+            df.to_parquet(temp_path, compression="zstd")
+            pd.read_parquet(temp_path) # Some dataframes, e.g. ones with NaN in a column MultiIndex, write fine but can't be read back, so check before keeping the cache
+            os.replace(temp_path, cache_path) # Only a complete, readable cache ever gets the real name
+        except _PARQUET_CACHE_ERRORS: # e.g. the data directory is read only, or the dataframe has types Parquet can't store. The cache is just an optimization, so we go on without it.
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    return df
+
 def unionize_indices(dataset, exclude=[]):
     """Return a union of all indices in a dataset, without duplicates.
 
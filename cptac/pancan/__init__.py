@@ -9,6 +9,11 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import logging
+
+# gtfparse logs progress messages while our loaders read GTF files. Silence just its logger, once, so the root logger stays under the user's control.
+logging.getLogger('gtfparse').setLevel(logging.CRITICAL)
+
 from .file_download import download, download_pdc_id, list_pdc_datasets
 
 from .pdcbrca import PdcBrca
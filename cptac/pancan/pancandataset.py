@@ -12,8 +12,23 @@
 import cptac
 import cptac.exceptions as ex
 import pandas as pd
-import logging
-import cptac.utils as ut
+import numpy as np
+import itertools
+import collections
+
+def _classify_cnv(vals):
+    """Classify CNV values as 'Deletion' (<= -0.2), 'Amplification' (>= 0.2), or 'No_Mutation' (everything else, including NaN), in one vectorized pass.
+
+    Parameters:
+    vals (array-like of float): The CNV values to classify.
+
+    Returns:
+    numpy.ndarray of object: The classification of each value.
+    """
+    vals = np.asarray(vals, dtype=float)
+    bins = np.digitize(vals, [np.nextafter(-.2, 0), .2]) # Nudging the first edge toward zero puts exactly -0.2 in the Deletion bin
+    bins[np.isnan(vals)] = 1 # digitize puts NaN past every edge, but NaN isn't an amplification
+    return np.array(['Deletion', 'No_Mutation', 'Amplification'], dtype=object)[bins]
 
 class PancanDataset:
 
@@ -22,13 +37,12 @@ class PancanDataset:
 
         self._cancer_type = cancer_type
         self._version = version
+        # Resolve each source's version once. A dict gives per-source versions; anything else (e.g. "latest") applies to every source.
+        self._version_for = dict(version) if isinstance(version, dict) else {}
+        self._default_version = None if isinstance(version, dict) else version
         self._datasets = {} # Child class __init__ needs to fill this
         self._joining_dataset = None
-        
-        #ignore logging messages
-        logger = logging.getLogger()
-        logger.setLevel(logging.CRITICAL)
-        
+
 
     # Clinical table getters
     def get_clinical(self, source = 'mssm', tissue_type="both", imputed=False):
@@ -179,226 +193,213 @@ class PancanDataset:
         print_list (bool, optional): Whether to print the list. Default is True. Otherwise, it's returned as a string.
         """
 
-        # This dict will be keyed by data type, and the values will be each source that provides that data type
-        data_sources = {}
+        # This dict will be keyed by data type, and the values will be lists of each source that provides that data type
+        data_sources = collections.defaultdict(list)
 
-        for source in sorted(self._datasets.keys()):
-            for df_name in sorted(self._datasets[source]._data.keys()):
+        for source, dataset in sorted(self._datasets.items()):
+            for df_name in sorted(dataset._data):
 
                 if df_name in ["cibersort", "xcell"]:
                     df_name = f"deconvolution_{df_name}" # For clarity
 
-                if df_name in data_sources.keys():
-                    data_sources[df_name][0] += f", {source}"
-                else:
-                    data_sources[df_name] = [source]
+                data_sources[df_name].append(source)
 
-        data_sources = pd.\
-        DataFrame(data_sources).\
-        transpose().\
-        sort_index().\
-        reset_index()
+        # Join each list of sources only once, at the end
+        data_sources = pd.DataFrame({
+            "Data type": list(data_sources.keys()),
+            "Available sources": [", ".join(sources) for sources in data_sources.values()]
+        })
 
-        data_sources.columns=["Data type", "Available sources"]
+        data_sources = data_sources.sort_values(by="Data type").reset_index(drop=True)
 
         return data_sources
         
 
 
     # "Private" methods
-    def _get_dataframe(self, name, source, tissue_type, imputed):
-        """Check that a given dataframe from a given source exists, and return a copy if it does."""
+    def _get_dataframe(self, name, source, tissue_type, imputed, copy=True):
+        """Check that a given dataframe from a given source exists, and return a copy if it does.
+
+        Parameters:
+        copy (bool, optional): Whether to return a copy of the dataframe. Pass False only for internal read-only use: the dataframe is then shared with the source dataset, and must never be modified. Default True.
+        """
 
         if imputed:
             name = name + "_imputed"
 
-        if source in self._datasets.keys():
-            return self._datasets[source]._get_dataframe(name, tissue_type)
-        else:
+        dataset = self._datasets.get(source)
+        if dataset is None:
             raise ex.DataSourceNotFoundError(f"Data source {source} not found for the {self._cancer_type} dataset.")
 
+        if not copy and tissue_type == "both" and name in dataset._data:
+            return dataset._data[name] # Internal read-only use, so share the full table with the source dataset instead of copying it
+
+        return dataset._get_dataframe(name, tissue_type) # This is already a deep copy, so we don't copy it again. It also raises the errors for missing dataframes and invalid tissue types.
+
     def _get_version(self, source):
-        if self._version == "latest":
-            return self._version
-        elif type(self._version) is dict:
-            return self._version[source]
-        else:
-            return self._version
+        if self._default_version is None:
+            return self._version_for[source] # Raises a KeyError if the version dict leaves out this source
+        return self._default_version
         
     def get_genotype_all_vars(self, mutations_genes, omics_source, mutations_filter=None, show_location=True, mutation_hotspot=None):
         """Return a dataframe that has the mutation type and wheather or not it is a multiple mutation
         Parameters:
         mutation_genes (str, or list or array-like of str): The gene(s) to get mutation data for.
-        mutations_filter (list, optional):  List of mutations to prioritize when filtering out multiple mutations, in order of priority.
+        mutations_filter (list, optional):  List of mutations to prioritize when filtering out multiple mutations, in order of priority. If None, the default order is used, which puts deletions and truncations first.
+        omics_source(str): Source of omics data ex "bcm", "washu", "broad", "umich"
+        show_location (bool, optional): Whether to include the Location column from the mutation dataframe. Defaults to True.
+        mutation_hotspot (optional): a list of hotspots
+        """
+        return self.get_genotype_all_vars_batch([mutations_genes], omics_source, mutations_filter=mutations_filter, show_location=show_location, mutation_hotspot=mutation_hotspot)[mutations_genes]
+
+    def get_genotype_all_vars_batch(self, mutations_genes_list, omics_source, mutations_filter=None, show_location=True, mutation_hotspot=None):
+        """Return the get_genotype_all_vars dataframe for each of several genes. The CNV and mutation data are joined only once for all the genes, which is much faster than calling get_genotype_all_vars for each gene.
+        Parameters:
+        mutations_genes_list (str, or list or array-like of str): The genes to get mutation data for.
         omics_source(str): Source of omics data ex "bcm", "washu", "broad", "umich"
+        mutations_filter (list, optional):  List of mutations to prioritize when filtering out multiple mutations, in order of priority. If None, the default order is used, which puts deletions and truncations first.
         show_location (bool, optional): Whether to include the Location column from the mutation dataframe. Defaults to True.
         mutation_hotspot (optional): a list of hotspots
+
+        Returns:
+        dict: Keyed by gene, with that gene's get_genotype_all_vars dataframe as the value.
         """
+        if isinstance(mutations_genes_list, str):
+            mutations_genes_list = [mutations_genes_list]
+        mutations_genes_list = list(dict.fromkeys(mutations_genes_list)) # Drop duplicate genes, keeping the order
+
+        #check which genes are in the somatic_mutation DataFrame
+        somatic_mutation = self._get_dataframe("somatic_mutation", "harmonized", "both", imputed=False, copy=False)
+        somatic_genes = set(somatic_mutation["Gene"].unique())
+        genotypes = {}
+
+        #if a gene isn't in the somacic mutations df it will still have CNV data that we want
+        cnv_only_genes = [gene for gene in mutations_genes_list if gene not in somatic_genes]
+        if len(cnv_only_genes) > 0:
+            cnv = self._get_dataframe("CNV", omics_source, "both", imputed=False, copy=False)
+            for gene in cnv_only_genes:
+                genotypes[gene] = self._get_genotype_from_cnv(cnv, gene)
+
+        mutated_genes = [gene for gene in mutations_genes_list if gene in somatic_genes]
+        if len(mutated_genes) > 0:
+            #combine the cnv and mutations dataframe, for all the genes at once
+            combined = self.join_omics_to_mutations(omics_df_name="CNV", mutations_genes=mutated_genes, omics_genes=mutated_genes, omics_source = omics_source)
+
+            #drop the database index
+            if combined.columns.nlevels > 1 and 'Database_ID' in combined.columns.names:
+                combined.columns = combined.columns.droplevel('Database_ID')
+
+            for gene in mutated_genes:
+                genotypes[gene] = self._get_genotype_from_joined(combined, gene, omics_source, show_location, mutation_hotspot, mutations_filter)
+
+        return {gene: genotypes[gene] for gene in mutations_genes_list}
+
+    def _get_genotype_from_cnv(self, cnv, mutations_genes):
+        """Build the get_genotype_all_vars dataframe for a gene with no somatic mutations, using only its CNV values."""
+        gene_cnv = cnv[[mutations_genes]]
+        #drop the database index from ccrcc and brca. We do this on the selected gene only, since cnv is shared and must not be modified.
+        if gene_cnv.columns.nlevels > 1:
+            gene_cnv.columns = gene_cnv.columns.droplevel('Database_ID')
+        mutation_col = pd.Categorical(_classify_cnv(gene_cnv[mutations_genes]))
+        df = gene_cnv.assign(Mutation = mutation_col)
+        return df
+
+    def _get_genotype_from_joined(self, combined, mutations_genes, omics_source, show_location, mutation_hotspot, mutations_filter=None):
+        """Build the get_genotype_all_vars dataframe for one gene, from CNV data already joined to mutation data for one or more genes."""
 
         #If they don't give us a filter, this is the default.
-           
-        mutations_filter = ["Deletion",
-                                    'Frame_Shift_Del', 'Frame_Shift_Ins', 'Nonsense_Mutation', 'Nonstop_Mutation', #tuncation
-                                    'Missense_Mutation_hotspot',
-    	                           'Missense_Mutation',
-                                    'Amplification',
-                                    'In_Frame_Del', 'In_Frame_Ins', 'Splice_Site' ,
-                                    'De_Novo_Start_Out_Frame' ,'De_Novo_Start_In_Frame', 
-                                    'Start_Codon_Ins', 'Start_Codon_SNP', 
-                                    'Silent',
-                                    'Wildtype']
+        if mutations_filter is None:
+            mutations_filter = ["Deletion",
+                                        'Frame_Shift_Del', 'Frame_Shift_Ins', 'Nonsense_Mutation', 'Nonstop_Mutation', #tuncation
+                                        'Missense_Mutation_hotspot',
+        	                           'Missense_Mutation',
+                                        'Amplification',
+                                        'In_Frame_Del', 'In_Frame_Ins', 'Splice_Site' ,
+                                        'De_Novo_Start_Out_Frame' ,'De_Novo_Start_In_Frame', 
+                                        'Start_Codon_Ins', 'Start_Codon_SNP', 
+                                        'Silent',
+                                        'Wildtype']
 
         truncations = ['Frame_Shift_Del', 'Frame_Shift_Ins', 'Nonsense_Mutation', 'Nonstop_Mutation', 'Splice_Site']
         missenses = ['In_Frame_Del', 'In_Frame_Ins', 'Missense_Mutation']
         noncodings = ["Intron", "RNA", "3'Flank", "Splice_Region", "5'UTR", "5'Flank", "3'UTR"]
 
+        # Names of this gene's columns in the joined dataframe
+        cnv_col = f"{mutations_genes}_{omics_source}_CNV"
+        mut_col = f"{mutations_genes}_Mutation"
+        loc_col = f"{mutations_genes}_Location"
 
-
-        #check that gene is in the somatic_mutation DataFrame
-        somatic_mutation = self.get_somatic_mutation()
-        if mutations_genes not in somatic_mutation["Gene"].unique(): #if the gene isn't in the somacic mutations df it will still have CNV data that we want
-            def add_del_and_amp_no_somatic(row):
-                if row[mutations_genes] <= -.2:
-                    mutations = 'Deletion'
-
-                elif row[mutations_genes] >= .2:
-                    mutations = 'Amplification'
-                else:
-                    mutations = "No_Mutation"
-
-                return mutations
-            
-            cnv = self.get_CNV(source = omics_source)
-            #drop the database index from ccrcc and brca
-            if isinstance(cnv.keys(), pd.core.indexes.multi.MultiIndex):
-                drop = ['Database_ID']
-                cnv = ut.reduce_multiindex(df=cnv, levels_to_drop=drop)       
-            gene_cnv = cnv[[mutations_genes]]
-            mutation_col = gene_cnv.apply(add_del_and_amp_no_somatic, axis=1)
-            df = gene_cnv.assign(Mutation = mutation_col)
-            return df
-
-
-        #combine the cnv and mutations dataframe
-        combined = self.join_omics_to_mutations(omics_df_name="CNV", mutations_genes=mutations_genes, omics_genes=mutations_genes, omics_source = omics_source)
-                
-
-        #drop the database index 
-        drop = ['Database_ID']
-        combined = ut.reduce_multiindex(df=combined, levels_to_drop=drop)
+        #keep only this gene's columns
+        combined = combined.loc[:, [cnv_col, mut_col, loc_col]]
 
 
         #If there are hotspot mutations, append 'hotspot' to the mutation type so that it's prioritized correctly
-        def mark_hotspot_locations(row):
-            #iterate through each location in the current row
-            mutations = []
-            for location in row[mutations_genes+'_Location']:
-                if location in mutation_hotspot: #if it's a hotspot mutation
-                    #get the position of the location
-                    position = row[mutations_genes+'_Location'].index(location)
-                    #use that to change the correct mutation
-                    mutations.append(row[mutations_genes+"_Mutation"][position] + "_hotspot")
-                else:
-                    # get the position of the location
-                    position = row[mutations_genes+'_Location'].index(location)
-                    mutations.append(row[mutations_genes+"_Mutation"][position])
-            return mutations
+        def mark_hotspot_locations(df):
+            # Explode the location and mutation lists into one row per mutation, so hotspots can be marked in a single vectorized pass
+            locations = df[loc_col].explode()
+            mutations = df[mut_col].explode()
+            is_hotspot = locations.isin(mutation_hotspot)
+            mutations = mutations.where(~is_hotspot, mutations + "_hotspot")
+
+            # Re-nest the mutations into one list per sample
+            return mutations.groupby(level=0, sort=False).agg(list)
 
         if mutation_hotspot is not None:
-            combined['hotspot'] = combined.apply(mark_hotspot_locations, axis=1)
-            combined[mutations_genes+"_Mutation"] = combined['hotspot']
-            combined = combined.drop(columns='hotspot')
+            combined[mut_col] = mark_hotspot_locations(combined)
      
 
         # Based on cnv make a new column with mutation type that includes deletions and amplifications
-        def add_del_and_amp(row):
-            if row[mutations_genes+ "_" + omics_source + "_CNV"] <= -.2:
-                mutations = row[mutations_genes+"_Mutation"] + ['Deletion']
-                locations = row[mutations_genes+'_Location']+['Deletion']
-
-            elif row[mutations_genes + "_" + omics_source+"_CNV"] >= .2:
-                mutations = row[mutations_genes+"_Mutation"] + ['Amplification']
-                locations = row[mutations_genes+'_Location']+['Amplification']
-            else:
-                mutations = row[mutations_genes+"_Mutation"]
-                locations = row[mutations_genes+"_Location"]
-
-            return mutations, locations
-
+        cnv_calls = [[] if call == 'No_Mutation' else [call] for call in _classify_cnv(combined[cnv_col])]
 
-        combined['mutations'], combined['locations'] = zip(*combined.apply(add_del_and_amp, axis=1))
+        combined['mutations'] = [mut_list + call for mut_list, call in zip(combined[mut_col], cnv_calls)]
+        combined['locations'] = [loc_list + call for loc_list, call in zip(combined[loc_col], cnv_calls)]
        
         #now that we have the deletion and amplifications, we need to prioritize the correct mutations.
-        def sort(row):
-            sortedcol = []
-            location = []
-            chosen_indices = []
-            sample_mutations_list = row['mutations']
-            sample_locations_list = row['locations']
-            if len(sample_mutations_list) == 1: #if there's only one mutation in the list
-                sortedcol.append(sample_mutations_list[0])
-                location.append(sample_locations_list[0])
-
-            else:
-                for filter_val in mutations_filter: # This will start at the beginning of the filter list, thus filters earlier in the list are prioritized, like we want
-                    if filter_val in sample_mutations_list:
-                        chosen_indices = [index for index, value in enumerate(sample_mutations_list) if value == filter_val]
-                    if len(chosen_indices) > 0: # We found at least one mutation from the filter to prioritize, so we don't need to worry about later values in the filter priority list
-                        break
-
-                if len(chosen_indices) == 0: # None of the mutations for the sample were in the filter, so we're going to have to use our default hierarchy
-                    for mutation in sample_mutations_list:
-                        if mutation in truncations:
-                            chosen_indices += [index for index, value in enumerate(sample_mutations_list) if value == mutation]
-
-                if len(chosen_indices) == 0: # None of them were in the filter, nor were truncations, so we'll grab all the missenses
-                    for mutation in sample_mutations_list:
-                        if mutation in missenses:
-                            chosen_indices += [index for index, value in enumerate(sample_mutations_list) if value == mutation]
-
-                if len(chosen_indices) == 0: # None of them were in the filter, nor were truncations, nor missenses, so we'll grab all the noncodings
-                    for mutation in sample_mutations_list:
-                        if mutation in noncodings:
-                            chosen_indices += [index for index, value in enumerate(sample_mutations_list) if value == mutation]
-
-                soonest_mutation = sample_mutations_list[chosen_indices[0]]
-                soonest_location = sample_locations_list[chosen_indices[0]]
-                chosen_indices.clear()
-                sortedcol.append(soonest_mutation)
-                location.append(soonest_location)
-
-            return pd.Series([sortedcol, location],index=['mutations', 'locations'])
-
-        df = combined.apply(sort, axis=1)
-        combined['Mutation'] = df['mutations']
-        combined['Location'] = df['locations']
+        # Rank each mutation type once. Lower ranks are chosen first: mutations in the filter, in filter order, then truncations, missenses, and noncodings.
+        num_filters = len(mutations_filter)
+        rank = {mutation: index for index, mutation in reversed(list(enumerate(mutations_filter)))} # Reversed so the earliest position wins if a mutation is listed twice
+        for tier, tier_mutations in enumerate([truncations, missenses, noncodings]):
+            for mutation in tier_mutations:
+                rank.setdefault(mutation, num_filters + tier)
+        unranked = num_filters + 3 # Mutation types outside of all our lists can only be chosen as a last resort
+
+        # Lay the mutation and location lists out as 2D arrays, one sample per row, padded on the right
+        mutations_lists = combined['mutations'].tolist()
+        lengths = np.fromiter(map(len, mutations_lists), dtype=np.int64, count=len(mutations_lists))
+        valid = np.arange(lengths.max(initial=1)) < lengths[:, np.newaxis] # At least one column, so argmin works even with no samples
+        mutation_matrix = np.full(valid.shape, '', dtype=object)
+        mutation_matrix[valid] = list(itertools.chain.from_iterable(mutations_lists)) # Boolean mask assignment fills row by row, in list order
+        location_matrix = np.full(valid.shape, '', dtype=object)
+        location_matrix[valid] = list(itertools.chain.from_iterable(combined['locations']))
+
+        # Factorize so we only look up the rank of each distinct mutation type, not of every mutation
+        factorized, uniques = pd.factorize(mutation_matrix[valid])
+        unique_ranks = np.array([rank.get(mutation, unranked) for mutation in uniques], dtype=np.int32)
+        rank_matrix = np.full(valid.shape, unranked + 1, dtype=np.int32) # Padding is never chosen
+        rank_matrix[valid] = np.where(factorized >= 0, unique_ranks[factorized], unranked) # Factorize marks NaN with -1
+
+        # argmin returns the first of any tied ranks, so earlier mutations win ties
+        chosen = rank_matrix.argmin(axis=1)
+        rows = np.arange(len(chosen))
+        # Mutations and locations can be NaN (e.g. samples missing from the mutation data), so make them all strings
+        combined['Mutation'] = mutation_matrix[rows, chosen].astype(str)
+        combined['Location'] = location_matrix[rows, chosen].astype(str)
 
         #get a sample_status column that says if the gene has multiple mutations (including dletion and amplification)
-        def sample_status(row):
-            if len(row['mutations']) > 1: #if there's more than one mutation
-                if len(row['mutations']) == 2 and "Wildtype_Tumor" in row['mutations']: #one of the mutations might be a "wildtype tumor"
-                    status ="Single_mutation"
-
-                elif len(row['mutations']) == 2 and "Wildtype_Normal" in row['mutations']:
-                    status ="Single_mutation"
-
-                else:
-                    status = "Multiple_mutation"
-            else:
-                if row["mutations"] == ["Wildtype_Normal"]:
-                    status = "Wildtype_Normal"
-                elif row['mutations'] == ['Wildtype_Tumor']:
-                    status = "Wildtype_Tumor"
-                else:
-                    status = "Single_mutation"
-
-            return status
-        combined['Mutation_Status'] = combined.apply(sample_status, axis=1)
+        has_wt_tumor = (mutation_matrix == "Wildtype_Tumor").any(axis=1)
+        has_wt_normal = (mutation_matrix == "Wildtype_Normal").any(axis=1)
+        combined['Mutation_Status'] = np.select(
+            [(lengths > 1) & ~((lengths == 2) & (has_wt_tumor | has_wt_normal)), # one of two mutations might be a "wildtype tumor" or "wildtype normal", which still counts as a single mutation
+             (lengths == 1) & has_wt_normal,
+             (lengths == 1) & has_wt_tumor],
+            ["Multiple_mutation", "Wildtype_Normal", "Wildtype_Tumor"],
+            default="Single_mutation").astype(object)
 
         #drop all the unnecessary Columns
-        df = combined.drop(columns=[mutations_genes+ "_" + omics_source +"_CNV", mutations_genes+"_Mutation", mutations_genes+"_Location", mutations_genes+"_Mutation_Status", 'Sample_Status', 'mutations','locations'])
-        df['Mutation'] = [','.join(map(str, l)) for l in df['Mutation']]
-        df['Location'] = [','.join(map(str, l)) for l in df['Location']]
+        df = combined.drop(columns=[cnv_col, mut_col, loc_col, 'mutations','locations'])
+        # Mutation types and statuses are a few distinct strings repeated across samples, so store them as categoricals
+        df['Mutation'] = df['Mutation'].astype('category')
+        df['Mutation_Status'] = df['Mutation_Status'].astype('category')
         if show_location == False: df = df.drop(columns="Location") #if they don't want us to show the location, drop it
        
         return df
\ No newline at end of file
@@ -14,11 +14,114 @@ import numpy as np
 import os
 import warnings
 import datetime
+import re
 
 from cptac.dataset import Dataset
 from cptac.dataframe_tools import *
 from cptac.exceptions import FailedReindexWarning, PublicationEmbargoWarning, ReindexMapError
 
+# Sample type labels in the Patient_IDs. Tumor labels are removed, and normal (-N, or -A in the phosphoproteomics file) and cored normal (-C) labels become .N and .C
+_SAMPLE_SUFFIXES = re.compile(r'-([TNC])$')
+_PHOSPHO_SAMPLE_LABELS = re.compile(r'-([TA])')
+_PHOSPHO_SAMPLE_SUFFIXES = re.compile(r'-([TN])$')
+_SUFFIX_REPLACEMENTS = {'T': '', 'N': '.N', 'C': '.C', 'A': '.N'}
+
+# Fields of the multi-site Index column: protein, transcript, gene, Havana gene, Havana transcript, transcript name, gene name, and an underscore separated site description whose last part is the phospho site.
+# Rows without a site description don't match, and get dropped.
+_MULTI_SITE_INDEX = re.compile(r'^[^|]*\|[^|]*\|(?P<Database_ID>[^|]*)\|[^|]*\|[^|]*\|[^|]*\|(?P<Name>[^|]*)\|(?:[^_|]*_){5}(?P<Site>[^_|]*)$')
+
+# Quality control, pooled and reference intensity samples that we drop from the tables
+_DROP_QC = frozenset(['128C', 'QC2', 'QC3', 'QC4', '129N', 'LungTumor1', 'Pooled-sample14',
+    'LungTumor2', 'QC6', 'LungTumor3', 'Pooled-sample17', 'QC7', 'Pooled-sample19', 'QC9'] +
+    [f'RefInt_pool{i:02d}' for i in range(1, 21)])
+# The phosphoproteomics table also drops its cored normal samples
+_DROP_QC_PHOS = _DROP_QC | {'C3L-00994-C', 'C3L-02617-C', 'C3L-04350-C', 'C3L-05257-C', 'C3N-01757-C', 'C3N-03042-C'}
+
+_PARSER_VERSION = 1 # Cache version for both parsing functions below, see read_with_parquet_cache
+
+def _reference_ratios(df):
+    """Convert a wide table of intensities to ratios against its ReferenceIntensity column, and transpose it so samples are rows.
+    The subtraction is done with numpy broadcasting on the underlying array, which skips pandas' label alignment. The result is never copied to transpose it: pandas stores a DataFrame's values with columns as rows, so wrapping the transposed view without copying keeps the array we computed as is.
+
+    Parameters:
+    df (pandas.DataFrame): Log intensities, with features as rows, and a ReferenceIntensity column followed by one column per sample.
+
+    Returns:
+    pandas.DataFrame: The log ratios, with samples as rows and features as columns.
+    """
+    ref_intensities = df["ReferenceIntensity"].to_numpy(dtype=np.float64) # Get reference intensities to use to calculate ratios 
+    samples = df.columns.drop("ReferenceIntensity")
+    ratios = df[samples].to_numpy(dtype=np.float64) - ref_intensities[:, np.newaxis] # Subtract reference intensities from all the values 
+    return pd.DataFrame(ratios.T, index=samples, columns=df.index, copy=False)
+
+def _parse_proteomics(file_path):
+    """Parse the protein level abundance report into the proteomics dataframe.
+
+    Parameters:
+    file_path (str): The path to the protein report.
+
+    Returns:
+    pandas.DataFrame: The log ratios, with Patient_IDs as rows, tumors first and then normals, and (Name, Database_ID) as columns.
+    """
+    header = pd.read_csv(file_path, sep = "\t", nrows = 0).columns # Read just the header, so we can skip parsing columns we don't need
+    df = pd.read_csv(file_path, sep = "\t", engine=CSV_ENGINE, usecols = [col for col in header if col not in {'MaxPepProb', 'NumberPSM', 'Gene'}])
+    index_parts = df['Index'].str.split('|', expand=True) # Split the Index column once, and pick the fields we need from it
+    df['Database_ID'] = index_parts[0] # Get protein identifier 
+    df['Name'] = index_parts[6] # Get protein name 
+    df = df.set_index(['Name', 'Database_ID']) # set multiindex
+
+    # Drop unnecessary columns, and quality control and ref intensity cols, before transposing so they aren't copied
+    df = df.drop(columns = ['Index'])
+    df = df.loc[:, ~ df.columns.isin(_DROP_QC)]
+    df = _reference_ratios(df) # transpose, and subtract reference intensities from all the values 
+    df.index.name = 'Patient_ID'
+
+    # duplicates are averaged
+    df = average_replicates(df, common = '-duplicate', to_drop = '-duplicate.*')
+
+    df.index = replace_suffixes(df.index, _SAMPLE_SUFFIXES, _SUFFIX_REPLACEMENTS) # includes 6 cored normal samples 
+
+    # Sort values
+    is_normal = df.index.str.contains(r'\.[NC]$', regex = True) # match once, and use the mask for both slices
+    normal = df.loc[is_normal].sort_index()
+    tumor = df.loc[~ is_normal].sort_index()
+
+    all_df = pd.concat([tumor, normal])
+    return all_df.astype(np.float32) # single precision is plenty for log ratios
+
+def _parse_phosphoproteomics(file_path):
+    """Parse the multi-site abundance report into the phosphoproteomics dataframe.
+
+    Parameters:
+    file_path (str): The path to the multi-site report.
+
+    Returns:
+    pandas.DataFrame: The log ratios, with Patient_IDs as rows, tumors first and then normals, and (Name, Database_ID, Peptide, Site) as columns.
+    """
+    header = pd.read_csv(file_path, sep = "\t", nrows = 0).columns # Read just the header, so we can skip parsing columns we don't need
+    df = pd.read_csv(file_path, sep = "\t", engine=CSV_ENGINE, usecols = [col for col in header if col not in {'MaxPepProb', 'Gene'}])
+    df = df.drop(columns = ["Index"]).join(df["Index"].str.extract(_MULTI_SITE_INDEX)) # Extract just the fields we keep from the Index column, in one pass
+    df = df[df['Site'].notna()] # only keep columns with phospho site 
+    df = df.set_index(["Name","Database_ID","Peptide","Site"]) 
+
+    df.columns = replace_suffixes(df.columns, _PHOSPHO_SAMPLE_LABELS, _SUFFIX_REPLACEMENTS)
+    # Drop quality control and ref intensity cols before transposing, so they aren't copied
+    df = df.loc[:, ~ df.columns.isin(_DROP_QC_PHOS)]
+
+    df = _reference_ratios(df) # transpose, and subtract reference intensities from all the values, to get ratios
+    # duplicates are averaged
+    df = average_replicates(df, common = '-duplicate', to_drop = '-duplicate.*')
+
+    df.index = replace_suffixes(df.index, _PHOSPHO_SAMPLE_SUFFIXES, _SUFFIX_REPLACEMENTS)
+
+    # Sort values
+    df.index.name = 'Patient_ID'
+    is_normal = df.index.str.contains(r'\.N$', regex = True) # match once, and use the mask for both slices
+    normal = df.loc[is_normal].sort_index()
+    tumor = df.loc[~ is_normal].sort_index()
+    all_prot = pd.concat([tumor, normal])
+    return all_prot.astype(np.float32)
+
 
 class UmichHnscc(Dataset):
 
@@ -48,96 +151,21 @@ class UmichHnscc(Dataset):
 
         # Load the data into dataframes in the self._data dict
         loading_msg = f"Loading {self.get_cancer_type()} v{self.version()}"
-        for file_path in self._data_files_paths: # Loops through files variable
+        for num_loaded, file_path in enumerate(self._data_files_paths, start=1): # Loops through files variable
 
             # Print a loading message. We add a dot every time, so the user knows it's not frozen.
-            loading_msg = loading_msg + "."
-            print(loading_msg, end='\r')
+            print(loading_msg + "." * num_loaded, end='\r')
 
             path_elements = file_path.split(os.sep) # Get a list of the levels of the path
             file_name = path_elements[-1] # The last element will be the name of the file. We'll use this to identify files for parsing in the if/elif statements below
             
             
             if file_name == "Report_abundance_groupby=protein_protNorm=MD_gu=2.tsv":
-                df = pd.read_csv(file_path, sep = "\t") 
-                df['Database_ID'] = df.Index.apply(lambda x: x.split('|')[0]) # Get protein identifier 
-                df['Name'] = df.Index.apply(lambda x: x.split('|')[6]) # Get protein name 
-                df = df.set_index(['Name', 'Database_ID']) # set multiindex
-                df = df.drop(columns = ['Index', 'MaxPepProb', 'NumberPSM', 'Gene']) # drop unnecessary  columns
-                df = df.transpose()
-                ref_intensities = df.loc["ReferenceIntensity"] # Get reference intensities to use to calculate ratios 
-                df = df.subtract(ref_intensities, axis="columns") # Subtract reference intensities from all the values 
-                df = df.iloc[1:,:] # drop ReferenceIntensity row 
-                df.index.name = 'Patient_ID'
-
-                drop_cols = ['128C', 'QC2', 'QC3', 'QC4', '129N', 'LungTumor1', 'Pooled-sample14',
-                   'LungTumor2', 'QC6', 'LungTumor3', 'Pooled-sample17', 'QC7',
-                   'Pooled-sample19', 'QC9', 'RefInt_pool01', 'RefInt_pool02',
-                   'RefInt_pool03', 'RefInt_pool04', 'RefInt_pool05', 'RefInt_pool06',
-                   'RefInt_pool07', 'RefInt_pool08', 'RefInt_pool09', 'RefInt_pool10',
-                   'RefInt_pool11', 'RefInt_pool12', 'RefInt_pool13', 'RefInt_pool14',
-                   'RefInt_pool15', 'RefInt_pool16', 'RefInt_pool17', 'RefInt_pool18',
-                   'RefInt_pool19', 'RefInt_pool20']
-    
-                # Drop quality control and ref intensity cols
-                df = df.drop(drop_cols, axis = 'index')
-
-                # duplicates are averaged
-                df = average_replicates(df, common = '-duplicate', to_drop = '-duplicate.*')
-
-                df.index = df.index.str.replace('-T$','', regex = True)
-                df.index = df.index.str.replace('-N$','.N', regex = True)
-                df.index = df.index.str.replace('-C$','.C', regex = True) # 6 cored normal samples 
-
-                # Sort values
-                normal = df.loc[df.index.str.contains('\.[NC]$', regex = True)]
-                normal = normal.sort_values(by=["Patient_ID"])
-                tumor = df.loc[~ df.index.str.contains('\.[NC]$', regex = True)]
-                tumor = tumor.sort_values(by=["Patient_ID"])
-
-                all_df = tumor.append(normal)
-                self._data["proteomics"] = all_df
+                self._data["proteomics"] = read_with_parquet_cache(file_path, _parse_proteomics, f".v{_PARSER_VERSION}.parquet")
                 
                 
             elif file_name == "Report_abundance_groupby=multi-site_protNorm=MD_gu=2.tsv":
-                df = pd.read_csv(file_path, sep = "\t") 
-                df[['Protein_ID','Transcript_ID',"Database_ID","Havana_gene","Havana_transcript","Transcript","Name","Site"]] = df.Index.str.split("\\|",expand=True)
-                df[['num1','num2',"num3","num4","num5","Site"]] = df.Site.str.split("_",expand=True) 
-                df = df[df['Site'].notna()] # only keep columns with phospho site 
-                df = df.set_index(["Name","Database_ID","Peptide","Site"]) 
-                #drop columns not needed in df 
-                df.drop([ 'Gene', "Index","num1","num2","num3","num4","num5","Havana_gene","Havana_transcript","MaxPepProb","Protein_ID","Transcript_ID","Transcript"], axis=1, inplace=True)
-                
-                df = df.T #transpose df 
-                ref_intensities = df.loc["ReferenceIntensity"]# Get reference intensities to use to calculate ratios 
-                df = df.subtract(ref_intensities, axis="columns") # Subtract reference intensities from all the values, to get ratios
-                df = df.iloc[1:,:] # drop ReferenceIntensity row 
-
-                df.index = df.index.str.replace(r"-T", "", regex=True)
-                df.index = df.index.str.replace(r"-A", ".N", regex=True)
-                drop_cols_phos = ['128C','QC2','QC3','QC4','129N','LungTumor1','Pooled-sample14','LungTumor2', 'QC6',
-                                  'LungTumor3','Pooled-sample17','QC7','Pooled-sample19','QC9','RefInt_pool01','RefInt_pool02', 'RefInt_pool03','RefInt_pool04','RefInt_pool05','RefInt_pool06','RefInt_pool07','RefInt_pool08','RefInt_pool09',
- 'RefInt_pool10','RefInt_pool11','RefInt_pool12','RefInt_pool13','RefInt_pool14','RefInt_pool15','RefInt_pool16','RefInt_pool17',
- 'RefInt_pool18','RefInt_pool19','RefInt_pool20','C3L-00994-C', 'C3L-02617-C', 
-                   'C3L-04350-C', 'C3L-05257-C', 'C3N-01757-C', 'C3N-03042-C']
-              # Drop quality control and ref intensity cols
-                df = df.drop(drop_cols_phos, axis = 'index')
-              # duplicates are averaged
-                df = average_replicates(df, common = '-duplicate', to_drop = '-duplicate.*')
-
-                df.index = df.index.str.replace('-T$','', regex = True)
-                df.index = df.index.str.replace('-N$','.N', regex = True)
-                
-                
-                # Sort values
-                df.index.name = 'Patient_ID'
-                normal = df.loc[df.index.str.contains('\.N$', regex = True)]
-                normal = normal.sort_values(by=["Patient_ID"])
-                tumor = df.loc[~ df.index.str.contains('\.N$', regex = True)]
-                tumor = tumor.sort_values(by=["Patient_ID"])
-                all_prot = tumor.append(normal)
-                
-                self._data["phosphoproteomics"] = all_prot
+                self._data["phosphoproteomics"] = read_with_parquet_cache(file_path, _parse_phosphoproteomics, f".v{_PARSER_VERSION}.parquet")
             
             '''
             if file_name == "S039_BCprospective_observed_0920.tsv.gz":
@@ -159,7 +187,7 @@ class UmichHnscc(Dataset):
                 self._data["proteomics_imputed"] = df'''
                 
         
-        print(' ' * len(loading_msg), end='\r') # Erase the loading message
+        print(' ' * (len(loading_msg) + len(self._data_files_paths)), end='\r') # Erase the loading message, including its dots
         formatting_msg = "Formatting dataframes..."
         print(formatting_msg, end='\r')
 
@@ -14,7 +14,7 @@ import numpy as np
 import os
 import warnings
 import datetime
-import logging
+import re
 from gtfparse import read_gtf
 
 from cptac.dataset import Dataset
@@ -22,6 +22,70 @@ from cptac.dataframe_tools import *
 from cptac.exceptions import FailedReindexWarning, PublicationEmbargoWarning, ReindexMapError
 from .mssmclinical import MssmClinical
 
+# Sample type labels in the deconvolution Patient_IDs. Tumor labels are removed, and normal labels become .N
+_SAMPLE_SUFFIXES = re.compile(r'-([TA])$')
+_SUFFIX_REPLACEMENTS = {'T': '', 'A': '.N'}
+
+# Cache versions for the parsing functions below, see read_with_parquet_cache
+_SOMATIC_MUTATION_VERSION = 2
+_TRANSCRIPTOMICS_VERSION = 1
+_GENE_IDS_VERSION = 1
+
+def _read_gene_ids(file_path):
+    """Read the table of gene names and gene IDs from a gencode GTF file.
+
+    Parameters:
+    file_path (str): The path to the gencode GTF file.
+
+    Returns:
+    pandas.DataFrame: The Database_ID for each gene, indexed by Name.
+    """
+    df = read_gtf(file_path)
+    df = df[["gene_name","gene_id"]]
+    df = df.drop_duplicates()
+    df = df.rename(columns={"gene_name": "Name","gene_id": "Database_ID"})
+    df = df.set_index("Name")
+    return df
+
+def _parse_somatic_mutation(file_path):
+    """Parse the MAF file into the somatic_mutation dataframe.
+
+    Parameters:
+    file_path (str): The path to the MAF file.
+
+    Returns:
+    pandas.DataFrame: The mutations, indexed by Patient_ID, with the Gene, Mutation and Location columns first.
+    """
+    df = pd.read_csv(file_path, sep='\t', dtype={'Hugo_Symbol': 'category', 'Variant_Classification': 'category', 'Tumor_Sample_Barcode': 'category'}, low_memory=False) # these columns repeat a few values over many rows, so store them as categoricals. Reading in one pass keeps each column's type consistent, so it can be cached as Parquet.
+    df = df.rename(columns={
+             "Hugo_Symbol":"Gene",
+             "Gene":"Gene_Database_ID",
+             "Variant_Classification":"Mutation",
+             "HGVSp_Short":"Location"})
+
+    df.index = pd.Index(df['Tumor_Sample_Barcode'].str.replace('_T', '', regex=False), name='Patient_ID') # build the index straight from the barcodes, with a plain string replace
+    df = df[ ['Gene'] + ["Mutation"] + ["Location"] + [ col for col in df.columns if col not in ["Gene","Mutation","Location"] ] ]
+    return df
+
+def _parse_transcriptomics(file_path):
+    """Parse the FPKM RNA-Seq file into the transcriptomics dataframe.
+
+    Parameters:
+    file_path (str): The path to the FPKM file.
+
+    Returns:
+    pandas.DataFrame: The expression values, with Patient_IDs as rows and (Name, Database_ID) as columns.
+    """
+    df = pd.read_csv(file_path, sep="\t", engine=CSV_ENGINE)
+    df = df.rename(columns={"gene_name": "Name","gene_id": "Database_ID"})
+    df = df.set_index(["Name", "Database_ID"])
+    df = df.sort_index()
+    df = df.T
+    df.index.name = "Patient_ID"
+    #remove label for tumor samples. All samples are tumors 
+    df.index = df.index.str.replace(r"-T", "", regex=True) 
+    return df.astype(np.float32) # float32 is precise enough for FPKM values
+
 
 class WashuCoad(Dataset):
 
@@ -32,9 +96,6 @@ class WashuCoad(Dataset):
         version (str, optional): The version number to load, or the string "latest" to just load the latest building. Default is "latest".
         no_internet (bool, optional): Whether to skip the index update step because it requires an internet connection. This will be skipped automatically if there is no internet at all, but you may want to manually skip it if you have a spotty internet connection. Default is False.
         """
-        #ignore logging messages
-        logger = logging.getLogger()
-        logger.setLevel(logging.CRITICAL)
         
         # Set some needed variables, and pass them to the parent Dataset class __init__ function
 
@@ -60,17 +121,12 @@ class WashuCoad(Dataset):
         # Call the parent class __init__ function
         super().__init__(cancer_type="washucoad", version=version, valid_versions=valid_versions, data_files=data_files, no_internet=no_internet)
         
-        # get clinical df (used to slice out cancer specific patient_IDs in tumor_purity file)
-        mssmclin = MssmClinical(no_internet=no_internet, version="latest", filter_type='pancancoad') #_get_version - pancandataset
-        clinical_df = mssmclin.get_clinical()
-
         # Load the data into dataframes in the self._data dict
         loading_msg = f"Loading {self.get_cancer_type()} v{self.version()}"
-        for file_path in self._data_files_paths: # Loops through files variable
+        for num_loaded, file_path in enumerate(self._data_files_paths, start=1): # Loops through files variable
 
             # Print a loading message. We add a dot every time, so the user knows it's not frozen.
-            loading_msg = loading_msg + "."
-            print(loading_msg, end='\r')
+            print(loading_msg + "." * num_loaded, end='\r')
 
             path_elements = file_path.split(os.sep) # Get a list of the levels of the path
             file_name = path_elements[-1] # The last element will be the name of the file. We'll use this to identify files for parsing in the if/elif statements below
@@ -78,71 +134,45 @@ class WashuCoad(Dataset):
             
 
             if file_name == "CO_prospective.dnp.annotated.exonic.addrecovercases.maf.gz": # Note that we use the "file_name" variable to identify files. That way we don't have to use the whole path.
-                df = pd.read_csv(file_path, sep='\t')    
-                df = pd.read_csv(file_path, sep='\t')    
-                df['Patient_ID'] = df.loc[:, 'Tumor_Sample_Barcode']
-                df = df.rename(columns={
-                         "Hugo_Symbol":"Gene",
-                         "Gene":"Gene_Database_ID",
-                         "Variant_Classification":"Mutation",
-                         "HGVSp_Short":"Location"})
-
-                df = df.set_index("Patient_ID")
-                df = df[ ['Gene'] + ["Mutation"] + ["Location"] + [ col for col in df.columns if col not in ["Gene","Mutation","Location"] ] ]
-                df.index = df.index.str.replace(r"_T", "", regex=True)   
-              
-                self._data["somatic_mutation"] = df
+                self._data["somatic_mutation"] = read_with_parquet_cache(file_path, _parse_somatic_mutation, f".v{_SOMATIC_MUTATION_VERSION}.parquet")
                   
             if file_name == "CO_tumor_RNA-Seq_Expr_WashU_FPKM.tsv.gz":
-                df = pd.read_csv(file_path, sep="\t")
-                df = df.rename(columns={"gene_name": "Name","gene_id": "Database_ID"})
-                df = df.set_index(["Name", "Database_ID"])
-                df = df.sort_index()
-                df = df.T
-                df.index.name = "Patient_ID"
-                #remove label for tumor samples. All samples are tumors 
-                df.index = df.index.str.replace(r"-T", "", regex=True) 
-                self._data["transcriptomics"] = df
+                self._data["transcriptomics"] = read_with_parquet_cache(file_path, _parse_transcriptomics, f".v{_TRANSCRIPTOMICS_VERSION}.parquet")
                 
             elif file_name == "CO_xCell.txt":
-                df = pd.read_csv(file_path, sep = '\t', index_col = 0) 
+                df = pd.read_csv(file_path, sep = '\t', index_col = 0)
                 df = df.transpose()
                 df.columns.name = 'Name'
                 df.index.name = 'Patient_ID'
-                df.index = df.index.str.replace(r'-T$', '', regex=True) # remove label for tumor samples
-                df.index = df.index.str.replace(r'-A$', '.N', regex=True) # change label for normal samples
+                df.index = replace_suffixes(df.index, _SAMPLE_SUFFIXES, _SUFFIX_REPLACEMENTS) # remove label for tumor samples, and change label for normal samples
                 self._data["xcell"] = df
                 
             elif file_name == "CIBERSORT.Output_Abs_CO.txt":
-                df = pd.read_csv(file_path, sep = '\t', index_col = 0) 
+                df = pd.read_csv(file_path, sep = '\t', index_col = 0)
                 df.index.name = 'Patient_ID'
                 df.columns.name = 'Name'
-                df.index = df.index.str.replace(r'-T$', '', regex=True) 
-                df.index = df.index.str.replace(r'-A$', '.N', regex=True)
+                df.index = replace_suffixes(df.index, _SAMPLE_SUFFIXES, _SUFFIX_REPLACEMENTS)
                 self._data["cibersort"] = df
                 
             elif file_name == "CO.gene_level.from_seg.filtered.tsv":
-                df = pd.read_csv(file_path, sep="\t")
+                df = pd.read_csv(file_path, sep="\t", engine=CSV_ENGINE)
                 df = df.rename(columns={"Gene": "Name"})
                 df = df.set_index("Name")
                 self._data["CNV"] = df
                 
             elif file_name == "gencode.v22.annotation.gtf.gz":
-                df = read_gtf(file_path)
-                df = df[["gene_name","gene_id"]]
-                df = df.drop_duplicates()
-                df = df.rename(columns={"gene_name": "Name","gene_id": "Database_ID"})
-                df = df.set_index("Name")
-                self._helper_tables["CNV_gene_ids"] = df
+                self._helper_tables["CNV_gene_ids"] = read_with_parquet_cache(file_path, _read_gene_ids, f".nameid.v{_GENE_IDS_VERSION}.parquet")
                 
             elif file_name == "CPTAC_pancan_RNA_tumor_purity_ESTIMATE_WashU.tsv.gz":
                 df = pd.read_csv(file_path, sep = "\t", na_values = 'NA')
                 df.Sample_ID = df.Sample_ID.str.replace(r'-T', '', regex=True) # only tumor samples in file
                 df = df.set_index('Sample_ID') 
                 df.index.name = 'Patient_ID' 
-                # Use list of patient_ids to slice out cancers                
-                patient_ids = clinical_df.index.to_list()
-                df = df.loc[df.index.isin(patient_ids)]                
+                # get clinical df (used to slice out cancer specific patient_IDs in tumor_purity file). We only load it here, so it's skipped when this file isn't loaded.
+                mssmclin = MssmClinical(no_internet=no_internet, version="latest", filter_type='pancancoad') #_get_version - pancandataset
+                clinical_df = mssmclin.get_clinical()
+                # Use the clinical patient_IDs to slice out cancers. Passing the Index straight to isin avoids building a Python list of the IDs first.
+                df = df.loc[df.index.isin(clinical_df.index)]                
                 self._data["tumor_purity"] = df
             '''    
             elif file_name == "README_miRNA":
@@ -150,16 +180,17 @@ class WashuCoad(Dataset):
                     self._data["readme_miRNA"] = reader.read()'''
                 
 #
-        print(' ' * len(loading_msg), end='\r') # Erase the loading message
+        print(' ' * (len(loading_msg) + len(self._data_files_paths)), end='\r') # Erase the loading message, including its dots
         formatting_msg = "Formatting dataframes..."
         print(formatting_msg, end='\r')
         
         # CNV
         cnv = self._data["CNV"]
         gene_ids = self._helper_tables["CNV_gene_ids"]
-        df = cnv.join(gene_ids,how = "left") #merge in gene_ids 
-        df = df.reset_index()
-        df = df.set_index(["Name", "Database_ID"]) #create multi-index
+        # Merge in gene_ids by joining them to just the row positions, not the whole CNV table. A name with several gene_ids gets a row for each, and a name with none gets NaN.
+        rows = pd.DataFrame({"row": np.arange(len(cnv))}, index=cnv.index).join(gene_ids, how = "left")
+        df = cnv.iloc[rows["row"].to_numpy()]
+        df.index = pd.MultiIndex.from_arrays([rows.index, rows["Database_ID"]], names=["Name", "Database_ID"]) #create multi-index
         df = df.T
         df.index.name = 'Patient_ID'
         self._data["CNV"] = df
@@ -0,0 +1,122 @@
+#   Copyright 2018 Samuel Payne sam_payne@byu.edu
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Offline tests for PancanDataset.get_genotype_all_vars_batch, using small made up tables instead of downloaded data
+
+import pickle
+import pytest
+import numpy as np
+import pandas as pd
+from cptac.pancan.pancandataset import PancanDataset
+
+PATIENTS = ["P1", "P2", "P3", "P4"]
+
+class FakeSource:
+    """Stands in for a source dataset, serving dataframes from a dict."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def _get_dataframe(self, name, tissue_type="both"):
+        return self._data[name].copy(deep=True)
+
+class FakePancan(PancanDataset):
+    """A PancanDataset with TP53 mutations, and CNV data for TP53 and KRAS. KRAS has no mutations, so it's CNV only."""
+
+    def __init__(self):
+        super().__init__(cancer_type="fake", version="latest", no_internet=True)
+
+        self.cnv = pd.DataFrame({
+            ("TP53", "ENSG01"): [-0.5, 0.0, 0.3, 0.1],
+            ("KRAS", "ENSG02"): [0.4, -0.2, np.nan, 0.0]},
+            index=pd.Index(PATIENTS, name="Patient_ID"))
+        self.cnv.columns.names = ["Name", "Database_ID"]
+
+        somatic_mutation = pd.DataFrame({"Gene": ["TP53", "TP53", "TP53"], "Mutation": ["Missense_Mutation", "Silent", "Nonsense_Mutation"], "Location": ["p.R1H", "p.R2R", "p.Q3*"]},
+            index=pd.Index(["P2", "P2", "P3"], name="Patient_ID"))
+
+        self._datasets = {"harmonized": FakeSource({"somatic_mutation": somatic_mutation}), "washu": FakeSource({"CNV": self.cnv})}
+        self.num_joins = 0
+
+    def join_omics_to_mutations(self, omics_df_name, omics_source, mutations_genes, omics_genes=None, **kwargs):
+        """Build the joined table the real join would give for the TP53 mutations above."""
+        self.num_joins += 1
+        assert list(mutations_genes) == ["TP53"]
+
+        joined = pd.DataFrame({
+            ("TP53_washu_CNV", "ENSG01"): self.cnv[("TP53", "ENSG01")].to_numpy(),
+            ("TP53_Mutation", ""): [["Wildtype_Tumor"], ["Missense_Mutation", "Silent"], ["Nonsense_Mutation"], ["Wildtype_Tumor"]],
+            ("TP53_Location", ""): [["No_mutation"], ["p.R1H", "p.R2R"], ["p.Q3*"], ["No_mutation"]],
+            ("TP53_Mutation_Status", ""): ["Wildtype_Tumor", "Multiple_mutation", "Single_mutation", "Wildtype_Tumor"],
+            ("Sample_Status", ""): ["Tumor"] * 4},
+            index=pd.Index(PATIENTS, name="Patient_ID"))
+        joined.columns.names = ["Name", "Database_ID"]
+        return joined
+
+def test_batch_mixes_cnv_only_and_mutated_genes():
+    ds = FakePancan()
+    genotypes = ds.get_genotype_all_vars_batch(["KRAS", "TP53", "KRAS"], "washu")
+
+    assert list(genotypes.keys()) == ["KRAS", "TP53"]
+    assert ds.num_joins == 1
+
+    # KRAS has no mutations, so it's classified from its CNV values alone
+    assert genotypes["KRAS"]["Mutation"].astype(str).tolist() == ["Amplification", "Deletion", "No_Mutation", "No_Mutation"]
+
+    tp53 = genotypes["TP53"]
+    assert tp53["Mutation"].astype(str).tolist() == ["Deletion", "Missense_Mutation", "Nonsense_Mutation", "Wildtype_Tumor"]
+    assert tp53["Location"].tolist() == ["Deletion", "p.R1H", "p.Q3*", "No_mutation"]
+    # P1's deletion next to Wildtype_Tumor still counts as a single mutation, and P3's amplification makes a second mutation
+    assert tp53["Mutation_Status"].astype(str).tolist() == ["Single_mutation", "Multiple_mutation", "Multiple_mutation", "Wildtype_Tumor"]
+
+def test_batch_matches_single_gene_calls():
+    batch = FakePancan().get_genotype_all_vars_batch(["TP53", "KRAS"], "washu")
+    for gene in ["TP53", "KRAS"]:
+        pd.testing.assert_frame_equal(batch[gene], FakePancan().get_genotype_all_vars(gene, "washu"))
+
+def test_batch_uses_mutations_filter():
+    ds = FakePancan()
+    default = ds.get_genotype_all_vars_batch(["TP53"], "washu")["TP53"]
+    filtered = ds.get_genotype_all_vars_batch(["TP53"], "washu", mutations_filter=["Silent"])["TP53"]
+
+    # P2 has a missense and a silent mutation. The default order picks the missense, but the filter prioritizes the silent one.
+    assert default.loc["P2", "Mutation"] == "Missense_Mutation"
+    assert filtered.loc["P2", "Mutation"] == "Silent"
+    assert filtered.loc["P2", "Location"] == "p.R2R"
+
+def test_batch_does_not_modify_source_data():
+    ds = FakePancan()
+    cnv_before = ds.cnv.copy(deep=True)
+    ds.get_genotype_all_vars_batch(["KRAS", "TP53"], "washu")
+    pd.testing.assert_frame_equal(ds._datasets["washu"]._data["CNV"], cnv_before)
+
+def test_pancan_dataset_pickles():
+    # Worker processes need to be able to pickle datasets, so they mustn't hold lambdas
+    ds = FakePancan()
+    assert ds._get_version("washu") == "latest"
+    assert pickle.loads(pickle.dumps(ds))._get_version("washu") == "latest"
+
+    # A per-source version dict that leaves out a source can't give it a version
+    per_source = PancanDataset(cancer_type="fake", version={"washu": "1.0"}, no_internet=True)
+    per_source = pickle.loads(pickle.dumps(per_source))
+    assert per_source._get_version("washu") == "1.0"
+    with pytest.raises(KeyError):
+        per_source._get_version("bcm")
+
+def test_get_dataframe_shares_only_read_only_tables():
+    ds = FakePancan()
+    source_cnv = ds._datasets["washu"]._data["CNV"]
+
+    # Internal read-only use shares the source's table, but public getters get their own copy
+    assert ds._get_dataframe("CNV", "washu", "both", imputed=False, copy=False) is source_cnv
+    copied = ds._get_dataframe("CNV", "washu", "both", imputed=False)
+    assert copied is not source_cnv
+    pd.testing.assert_frame_equal(copied, source_cnv)
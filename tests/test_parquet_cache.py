@@ -0,0 +1,100 @@
+#   Copyright 2018 Samuel Payne sam_payne@byu.edu
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#       http://www.apache.org/licenses/LICENSE-2.0
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Offline tests for dataframe_tools.read_with_parquet_cache, using small made up files instead of downloaded data
+
+import os
+import pandas as pd
+import pytest
+from cptac.dataframe_tools import PARQUET_AVAILABLE, read_with_parquet_cache
+
+pytestmark = pytest.mark.skipif(not PARQUET_AVAILABLE, reason="pyarrow isn't installed")
+
+SUFFIX = ".v1.parquet"
+
+class CountingParser:
+    """Parses a tsv file into a dataframe, counting how many times it's called."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, file_path):
+        self.calls += 1
+        return pd.read_csv(file_path, sep="\t", index_col=0)
+
+def write_data_file(tmp_path):
+    file_path = str(tmp_path / "data.tsv")
+    pd.DataFrame({"A": [1.0, 2.0], "B": ["x", "y"]}, index=pd.Index(["P1", "P2"], name="Patient_ID")).to_csv(file_path, sep="\t")
+    return file_path
+
+def test_cache_hit(tmp_path):
+    file_path = write_data_file(tmp_path)
+    parse = CountingParser()
+
+    first = read_with_parquet_cache(file_path, parse, SUFFIX)
+    second = read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    assert parse.calls == 1
+    assert os.path.isfile(file_path + SUFFIX)
+    assert not os.path.exists(file_path + SUFFIX + ".tmp")
+    pd.testing.assert_frame_equal(first, second)
+
+def test_cache_miss_when_file_is_newer(tmp_path):
+    file_path = write_data_file(tmp_path)
+    parse = CountingParser()
+    read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    # Make the data file newer than its cache, as if it had been downloaded again
+    cache_time = os.path.getmtime(file_path + SUFFIX)
+    os.utime(file_path, (cache_time + 10, cache_time + 10))
+    read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    assert parse.calls == 2
+
+def test_unreadable_cache_is_replaced(tmp_path):
+    file_path = write_data_file(tmp_path)
+    with open(file_path + SUFFIX, "w") as cache_file:
+        cache_file.write("not a parquet file")
+    parse = CountingParser()
+
+    df = read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    assert parse.calls == 1
+    pd.testing.assert_frame_equal(pd.read_parquet(file_path + SUFFIX), df)
+
+def test_unwritable_frame_is_returned_without_a_cache(tmp_path):
+    file_path = write_data_file(tmp_path)
+
+    def parse(file_path):
+        return pd.DataFrame({"Mixed": [1, "a"]}) # an object column mixing ints and strings, which Parquet can't store
+
+    df = read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    assert df["Mixed"].tolist() == [1, "a"]
+    assert not os.path.exists(file_path + SUFFIX)
+    assert not os.path.exists(file_path + SUFFIX + ".tmp")
+
+def test_parquet_import_errors_fall_back_to_parsing(tmp_path, monkeypatch):
+    file_path = write_data_file(tmp_path)
+    parse = CountingParser()
+    read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    # pandas raises ImportError from both of these when the installed pyarrow is too old for it
+    def raise_import_error(*args, **kwargs):
+        raise ImportError("pyarrow is too old")
+    monkeypatch.setattr(pd, "read_parquet", raise_import_error)
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", raise_import_error)
+
+    df = read_with_parquet_cache(file_path, parse, SUFFIX)
+
+    assert parse.calls == 2
+    assert df["A"].tolist() == [1.0, 2.0]
+    assert not os.path.exists(file_path + SUFFIX + ".tmp")